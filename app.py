@@ -1,17 +1,23 @@
 from flask import Flask, request
 import shioaji as sj
-import json
+import datetime
+import functools
 import logging
+from logging.handlers import RotatingFileHandler
+import orjson
 import os
 import socket
 import sys
+import threading
+from zoneinfo import ZoneInfo
 
 app = Flask(__name__)
 
-# 設置日誌，寫入 /tmp/shioaji.log
+# 設置日誌，寫入 /tmp/shioaji.log，超過 50MB 輪替並保留 3 份備份
+# RotatingFileHandler 僅在單一程序內安全，服務只支援單一程序執行（見 README）
 logger = logging.getLogger('shioaji')
 logger.setLevel(logging.INFO)
-handler = logging.FileHandler('/tmp/shioaji.log')
+handler = RotatingFileHandler('/tmp/shioaji.log', maxBytes=50 * 1024 * 1024, backupCount=3)
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 handler.setFormatter(formatter)
 logger.handlers = [handler]
@@ -20,22 +26,215 @@ logger.handlers = [handler]
 try:
     hostname = socket.gethostname()
     ip_address = socket.gethostbyname(hostname)
-    logger.info(f"Service running on host: {hostname}, IP: {ip_address}")
+    logger.info("Service running on host: %s, IP: %s", hostname, ip_address)
 except Exception as e:
-    logger.error(f"Failed to get IP address: {str(e)}")
+    logger.error("Failed to get IP address: %s", e)
+
+# 回應序列化：orjson 直接輸出 UTF-8，無法原生序列化的物件（含 datetime）沿用 str()
+DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+def dumps(obj):
+    return orjson.dumps(obj, default=str, option=DUMPS_OPTIONS).decode()
+
+# 一次登入的 Shioaji API 實例與其合約資料狀態
+class Session:
+    def __init__(self, api):
+        self.api = api
+        # 合約資料下載完成時設定，登入後於背景下載期間為未設定
+        self.contracts_ready = threading.Event()
+        # 合約資料到期時間，交易所每日 08:30 前換月/新增序列，過期後需重新下載
+        self.contracts_expiry = None
+        # 登入後背景下載合約失敗的原因
+        self.contracts_error = None
+        # 此次登入的合約查詢快取，隨 Session 一起釋放，不會保留已被取代的 api
+        self.resolve_contract = functools.lru_cache(maxsize=65536)(functools.partial(resolve_contract, api))
+        # 是否正在下載合約（登入後的背景下載、過期更新或 /invalidate），同一實例同時只允許一個下載
+        self.contracts_downloading = True
+
+# 目前的登入狀態；lock 只用於檢查與更新狀態，不在持有期間下載合約
+# 讀取端每個請求只取用一次 state.session 的參照（單一屬性讀取為原子操作），
+# 之後的 api 與合約狀態都來自同一次登入
+class SessionState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+
+state = SessionState()
+
+# 每日合約資料更新時間（台北時間，不受主機時區影響）
+TAIPEI_TZ = ZoneInfo("Asia/Taipei")
+CONTRACTS_ROLL_TIME = datetime.time(8, 30)
+# 等待合約下載完成的時間上限（毫秒）
+CONTRACTS_TIMEOUT_MS = 60000
+
+def next_contracts_roll():
+    now = datetime.datetime.now(TAIPEI_TZ)
+    roll = datetime.datetime.combine(now.date(), CONTRACTS_ROLL_TIME, tzinfo=TAIPEI_TZ)
+    if now >= roll:
+        roll += datetime.timedelta(days=1)
+    return roll
+
+def contracts_stale(session):
+    # 尚未下載完成的登入不算過期，由背景下載負責
+    return session.contracts_ready.is_set() and datetime.datetime.now(TAIPEI_TZ) >= session.contracts_expiry
+
+def load_contracts(session):
+    # 下載期間不持有 lock，下載完成後確認仍為目前的登入才更新狀態並清除查詢快取
+    with state.lock:
+        if state.session is not session:
+            logger.info("Skipping contracts download for a superseded session")
+            return False
+    # 到期時間以開始下載時計算，跨過 08:30 才完成的下載不會被視為新一天的合約
+    expiry = next_contracts_roll()
+    logger.info("Fetching contracts data")
+    # 強制重新下載（不使用當日的本機合約檔），並等待下載完成後才返回
+    session.api.fetch_contracts(contract_download=True, contracts_timeout=CONTRACTS_TIMEOUT_MS)
+    status = getattr(session.api.Contracts, 'status', None)
+    if status is not None and getattr(status, 'name', status) != "Fetched":
+        raise RuntimeError(f"Contracts download not finished within {CONTRACTS_TIMEOUT_MS} ms (status={status})")
+    with state.lock:
+        if state.session is not session:
+            logger.info("Discarding contracts downloaded for a superseded session")
+            return False
+        session.contracts_expiry = expiry
+        session.contracts_error = None
+        session.resolve_contract.cache_clear()
+        session.contracts_ready.set()
+    logger.info("Contracts data fetched successfully, valid until %s", session.contracts_expiry)
+    return True
+
+def load_contracts_in_background(session):
+    try:
+        load_contracts(session)
+    except Exception as e:
+        logger.error("Error fetching contracts: %s", e)
+        logger.error("Exception type: %s", type(e).__name__)
+        logger.error("Exception traceback: %s", sys.exc_info())
+        with state.lock:
+            session.contracts_error = str(e)
+    finally:
+        with state.lock:
+            session.contracts_downloading = False
+
+def start_session(api):
+    # 登入後立即設為目前的登入，合約資料改在背景下載，避免阻塞 /login 回應
+    # 新的 Session 建立時 contracts_downloading 即為 True，由背景下載結束時清除
+    session = Session(api)
+    with state.lock:
+        state.session = session
+    threading.Thread(target=load_contracts_in_background, args=(session,), daemon=True).start()
+
+def contracts_unavailable(session):
+    # 合約資料尚未可用時回傳錯誤回應，否則回傳 None
+    if session.contracts_ready.is_set():
+        return None
+    if session.contracts_error is not None:
+        error_msg = f"Failed to fetch contracts data: {session.contracts_error}. Call /invalidate to retry."
+        logger.error(error_msg)
+        return {"statusCode": 500, "body": dumps({"error": error_msg})}
+    error_msg = "Contracts data is still loading. Please retry later."
+    logger.error(error_msg)
+    return {"statusCode": 503, "body": dumps({"error": error_msg})}
 
-# 全局變數，用於儲存 Shioaji API 實例
-api = None
+def refresh_contracts_in_background(session):
+    try:
+        logger.info("Contracts data expired, refreshing")
+        load_contracts(session)
+    except Exception as e:
+        # 更新失敗時繼續使用目前的合約資料，下一個請求會再次嘗試
+        logger.error("Error refreshing contracts: %s", e)
+        logger.error("Exception type: %s", type(e).__name__)
+        logger.error("Exception traceback: %s", sys.exc_info())
+    finally:
+        with state.lock:
+            session.contracts_downloading = False
+
+def refresh_contracts_if_stale(session):
+    with state.lock:
+        # 只啟動一個背景更新，更新完成前所有請求繼續使用目前的合約資料
+        if state.session is not session or session.contracts_downloading or not contracts_stale(session):
+            return
+        session.contracts_downloading = True
+    threading.Thread(target=refresh_contracts_in_background, args=(session,), daemon=True).start()
+
+def contracts_by_code(container):
+    # 以單次 getattr 取代 hasattr + 屬性存取，每個合約只查一次屬性
+    result = {}
+    for contract in container:
+        code = getattr(contract, 'code', None)
+        if code is not None:
+            result[code] = contract.__dict__
+    return result
+
+def enum_value(value):
+    return value.value if value is not None else None
+
+SUPPORTED_TYPES = ("stock", "futures", "options", "index")
+
+# 同一份合約資料下 code 對應的合約固定不變，由 Session.resolve_contract 快取查詢結果；重新下載合約時清除
+def resolve_contract(api, code, type_):
+    if type_ == "stock":
+        # 嘗試從 TSE 查詢股票合約
+        logger.info("Fetching contract for code=%s from TSE", code)
+        contract = api.Contracts.Stocks.TSE[code]
+        market = "TSE"
+
+        # 如果 TSE 中找不到，嘗試從 OTC 查詢
+        if contract is None:
+            logger.info("Contract not found in TSE, trying OTC for code=%s", code)
+            contract = api.Contracts.Stocks.OTC[code]
+            market = "OTC"
+
+        # 如果 OTC 中找不到，嘗試從 OES（興櫃）查詢
+        if contract is None:
+            logger.info("Contract not found in OTC, trying OES for code=%s", code)
+            try:
+                contract = api.Contracts.Stocks.OES[code]
+                market = "OES"
+            except AttributeError:
+                logger.info("OES market not supported or accessible in this context")
+
+        return contract, market
+
+    if type_ == "futures":
+        # 查詢期貨合約
+        logger.info("Fetching futures contract for code=%s", code)
+        return api.Contracts.Futures[code], "Futures"
+
+    if type_ == "options":
+        # 查詢選擇權合約
+        logger.info("Fetching options contract for code=%s", code)
+        return api.Contracts.Options[code], "Options"
+
+    # 查詢指數合約
+    logger.info("Fetching index contract for code=%s from TSE", code)
+    return api.Contracts.Indexs.TSE[code], "Index"
+
+def contract_not_found(api, code, type_):
+    if type_ == "stock":
+        error_msg = f"Contract not found for code={code} in TSE, OTC, or OES"
+    elif type_ == "futures":
+        # 列出所有期貨合約進行診斷，僅在 INFO 日誌啟用時建立清單
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Contract not found for code=%s, listing available futures contracts", code)
+            available_futures = contracts_by_code(api.Contracts.Futures)
+            logger.info("Available futures contracts: %s", available_futures)
+        error_msg = f"Futures contract not found for code={code}"
+    elif type_ == "options":
+        error_msg = f"Options contract not found for code={code}"
+    else:
+        error_msg = f"Index contract not found for code={code} in TSE"
+    logger.error(error_msg)
+    return {"statusCode": 500, "body": dumps({"error": error_msg})}
 
 @app.route('/login', methods=['POST'])
 def login():
-    global api
     try:
         data = request.get_json()
         if not data:
             error_msg = "Request body is empty"
             logger.error(error_msg)
-            return {"statusCode": 400, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+            return {"statusCode": 400, "body": dumps({"error": error_msg})}
 
         api_key = data.get("api_key")
         secret_key = data.get("secret_key")
@@ -44,65 +243,56 @@ def login():
         person_id = data.get("person_id")
         simulation_mode = data.get("simulation_mode", False)
 
-        missing_params = []
-        if not api_key:
-            missing_params.append("api_key")
-        if not secret_key:
-            missing_params.append("secret_key")
+        required_params = [("api_key", api_key), ("secret_key", secret_key)]
         if not simulation_mode:
-            if not ca_password:
-                missing_params.append("ca_password")
-            if not person_id:
-                missing_params.append("person_id")
+            required_params += [("ca_password", ca_password), ("person_id", person_id)]
+        missing_params = [name for name, value in required_params if not value]
 
         if missing_params:
             error_msg = f"Missing required parameters: {', '.join(missing_params)}"
             logger.error(error_msg)
-            return {"statusCode": 400, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+            return {"statusCode": 400, "body": dumps({"error": error_msg})}
 
         if not simulation_mode:
             if not os.path.exists(ca_path):
                 error_msg = f"CA file not found at {ca_path}"
                 logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
-            logger.info(f"CA file found at {ca_path}")
+                return {"statusCode": 500, "body": dumps({"error": error_msg})}
+            logger.info("CA file found at %s", ca_path)
 
-        logger.info(f"Received login request: api_key={api_key[:4]}****, secret_key={secret_key[:4]}****")
-        logger.info(f"Initializing Shioaji with simulation={simulation_mode}")
+        logger.info("Received login request: api_key=%s****, secret_key=%s****", api_key[:4], secret_key[:4])
+        logger.info("Initializing Shioaji with simulation=%s", simulation_mode)
         api = sj.Shioaji(simulation=simulation_mode)
 
         if not simulation_mode:
-            logger.info(f"Activating CA with ca_path={ca_path}, person_id={person_id}")
+            logger.info("Activating CA with ca_path=%s, person_id=%s", ca_path, person_id)
             result = api.activate_ca(ca_path=ca_path, ca_passwd=ca_password, person_id=person_id)
             if not result:
                 error_msg = "Failed to activate CA"
                 logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+                return {"statusCode": 500, "body": dumps({"error": error_msg})}
             logger.info("CA activated successfully")
 
         logger.info("Logging into Shioaji")
         accounts = api.login(api_key=api_key, secret_key=secret_key)
-        logger.info(f"Login successful, accounts: {json.dumps(accounts, default=str)}")
+        logger.info("Login successful, accounts: %s", accounts)
 
-        logger.info("Fetching contracts data")
-        api.fetch_contracts()
-        logger.info("Contracts data fetched successfully")
+        start_session(api)
 
         return {
             "statusCode": 200,
-            "body": json.dumps({"message": "Login successful", "accounts": accounts}, default=str, ensure_ascii=False)
+            "body": dumps({"message": "Login successful", "accounts": accounts})
         }
 
     except Exception as e:
         error_msg = f"Error in login: {str(e)}"
         logger.error(error_msg)
-        logger.error(f"Exception type: {type(e).__name__}")
-        logger.error(f"Exception traceback: {sys.exc_info()}")
-        return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        logger.error("Exception type: %s", type(e).__name__)
+        logger.error("Exception traceback: %s", sys.exc_info())
+        return {"statusCode": 500, "body": dumps({"error": error_msg})}
 
 @app.route('/quote', methods=['GET'])
 def quote():
-    global api
     try:
         code = request.args.get("code")  # 使用官方參數 "code"
         type_ = request.args.get("type", "stock")  # 預設為 stock
@@ -110,147 +300,91 @@ def quote():
         if not code:
             error_msg = "Missing required parameter: code"
             logger.error(error_msg)
-            return {"statusCode": 400, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+            return {"statusCode": 400, "body": dumps({"error": error_msg})}
 
-        if api is None:
+        session = state.session
+        if session is None:
             error_msg = "Shioaji API not initialized. Please login first."
             logger.error(error_msg)
-            return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
-
-        logger.info(f"Received quote request: code={code}, type={type_}")
-
-        # 根據 type 選擇合約類型
-        contract = None
-        market = None
-
-        if type_ == "stock":
-            # 嘗試從 TSE 查詢股票合約
-            logger.info(f"Fetching contract for code={code} from TSE")
-            contract = api.Contracts.Stocks.TSE[code]
-            market = "TSE"
-
-            # 如果 TSE 中找不到，嘗試從 OTC 查詢
-            if contract is None:
-                logger.info(f"Contract not found in TSE, trying OTC for code={code}")
-                contract = api.Contracts.Stocks.OTC[code]
-                market = "OTC"
-
-            # 如果 OTC 中找不到，嘗試從 OES（興櫃）查詢
-            if contract is None:
-                logger.info(f"Contract not found in OTC, trying OES for code={code}")
-                try:
-                    contract = api.Contracts.Stocks.OES[code]
-                    market = "OES"
-                except AttributeError:
-                    logger.info("OES market not supported or accessible in this context")
-
-            if contract is None:
-                error_msg = f"Contract not found for code={code} in TSE, OTC, or OES"
-                logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
-
-        elif type_ == "futures":
-            # 查詢期貨合約
-            logger.info(f"Fetching futures contract for code={code}")
-            contract = api.Contracts.Futures[code]
-            market = "Futures"
-
-            if contract is None:
-                logger.info(f"Contract not found for code={code}, listing available futures contracts")
-                available_futures = {c.code: c.__dict__ for c in list(api.Contracts.Futures) if hasattr(c, 'code')}
-                logger.info(f"Available futures contracts: {json.dumps(available_futures, default=str)}")
-                error_msg = f"Futures contract not found for code={code}"
-                logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+            return {"statusCode": 500, "body": dumps({"error": error_msg})}
 
-        elif type_ == "options":
-            # 查詢選擇權合約
-            logger.info(f"Fetching options contract for code={code}")
-            contract = api.Contracts.Options[code]
-            market = "Options"
-
-            if contract is None:
-                error_msg = f"Options contract not found for code={code}"
-                logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        unavailable = contracts_unavailable(session)
+        if unavailable is not None:
+            return unavailable
 
-        elif type_ == "index":
-            # 查詢指數合約
-            logger.info(f"Fetching index contract for code={code} from TSE")
-            contract = api.Contracts.Indexs.TSE[code]
-            market = "Index"
+        refresh_contracts_if_stale(session)
+        api = session.api
 
-            if contract is None:
-                error_msg = f"Index contract not found for code={code} in TSE"
-                logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        logger.info("Received quote request: code=%s, type=%s", code, type_)
 
-        else:
+        if type_ not in SUPPORTED_TYPES:
             error_msg = f"Unsupported type: {type_}. Supported types are: stock, futures, options, index"
             logger.error(error_msg)
-            return {"statusCode": 400, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+            return {"statusCode": 400, "body": dumps({"error": error_msg})}
+
+        contract, market = session.resolve_contract(code, type_)
+        if contract is None:
+            return contract_not_found(api, code, type_)
 
         # 記錄合約資料
-        logger.info(f"Contract found in {market}: {json.dumps(contract.__dict__, default=str)}")
+        logger.info("Contract found in %s: %s", market, contract.__dict__)
 
         # 查詢快照資料
-        logger.info(f"Fetching quote for code={code} (type={type_})")
+        logger.info("Fetching quote for code=%s (type=%s)", code, type_)
         quote = api.snapshots([contract])[0]
-        logger.info(f"Quote fetched successfully: {json.dumps(quote, default=str)}")
+        logger.info("Quote fetched successfully: %s", quote)
 
         return {
             "statusCode": 200,
-            "body": json.dumps({
+            "body": dumps({
                 "message": "Quote fetched",
                 "quote": quote,
                 "market": market,
                 "type": type_
-            }, default=str, ensure_ascii=False)
+            })
         }
 
     except KeyError as ke:
         error_msg = f"Contract not found for code={code} (type={type_}, KeyError: {str(ke)})"
         logger.error(error_msg)
-        return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        return {"statusCode": 500, "body": dumps({"error": error_msg})}
     except Exception as e:
         error_msg = f"Error in quote: {str(e)} (type={type_})"
         logger.error(error_msg)
-        logger.error(f"Exception type: {type(e).__name__}")
-        logger.error(f"Exception traceback: {sys.exc_info()}")
-        return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        logger.error("Exception type: %s", type(e).__name__)
+        logger.error("Exception traceback: %s", sys.exc_info())
+        return {"statusCode": 500, "body": dumps({"error": error_msg})}
 
 @app.route('/contracts', methods=['GET'])
 def get_contracts():
-    global api
     try:
-        if api is None:
+        session = state.session
+        if session is None:
             error_msg = "Shioaji API not initialized. Please login first."
             logger.error(error_msg)
-            return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+            return {"statusCode": 500, "body": dumps({"error": error_msg})}
+
+        unavailable = contracts_unavailable(session)
+        if unavailable is not None:
+            return unavailable
+
+        refresh_contracts_if_stale(session)
+        api = session.api
 
         # 獲取 TSE 股票合約資料
         logger.info("Fetching TSE contracts")
-        tse_contracts = {}
-        for contract in list(api.Contracts.Stocks.TSE):
-            if hasattr(contract, 'code'):
-                tse_contracts[contract.code] = contract.__dict__
+        tse_contracts = contracts_by_code(api.Contracts.Stocks.TSE)
         logger.info("TSE contracts fetched successfully")
 
         # 獲取 OTC 股票合約資料
         logger.info("Fetching OTC contracts")
-        otc_contracts = {}
-        for contract in list(api.Contracts.Stocks.OTC):
-            if hasattr(contract, 'code'):
-                otc_contracts[contract.code] = contract.__dict__
+        otc_contracts = contracts_by_code(api.Contracts.Stocks.OTC)
         logger.info("OTC contracts fetched successfully")
 
         # 獲取 OES（興櫃）股票合約資料
         logger.info("Fetching OES contracts")
-        oes_contracts = {}
         try:
-            for contract in list(api.Contracts.Stocks.OES):
-                if hasattr(contract, 'code'):
-                    oes_contracts[contract.code] = contract.__dict__
+            oes_contracts = contracts_by_code(api.Contracts.Stocks.OES)
             logger.info("OES contracts fetched successfully")
         except AttributeError:
             logger.info("OES market not supported or accessible in this context")
@@ -258,31 +392,22 @@ def get_contracts():
 
         # 獲取期貨合約資料
         logger.info("Fetching Futures contracts")
-        futures_contracts = {}
-        for contract in list(api.Contracts.Futures):
-            if hasattr(contract, 'code'):
-                futures_contracts[contract.code] = contract.__dict__
+        futures_contracts = contracts_by_code(api.Contracts.Futures)
         logger.info("Futures contracts fetched successfully")
 
         # 獲取選擇權合約資料
         logger.info("Fetching Options contracts")
-        options_contracts = {}
-        for contract in list(api.Contracts.Options):
-            if hasattr(contract, 'code'):
-                options_contracts[contract.code] = contract.__dict__
+        options_contracts = contracts_by_code(api.Contracts.Options)
         logger.info("Options contracts fetched successfully")
 
         # 獲取指數合約資料
         logger.info("Fetching Index contracts")
-        index_contracts = {}
-        for contract in list(api.Contracts.Indexs.TSE):
-            if hasattr(contract, 'code'):
-                index_contracts[contract.code] = contract.__dict__
+        index_contracts = contracts_by_code(api.Contracts.Indexs.TSE)
         logger.info("Index contracts fetched successfully")
 
         return {
             "statusCode": 200,
-            "body": json.dumps({
+            "body": dumps({
                 "message": "Contracts fetched",
                 "tse_contracts": tse_contracts,
                 "otc_contracts": otc_contracts,
@@ -290,19 +415,18 @@ def get_contracts():
                 "futures_contracts": futures_contracts,
                 "options_contracts": options_contracts,
                 "index_contracts": index_contracts
-            }, default=str, ensure_ascii=False)
+            })
         }
 
     except Exception as e:
         error_msg = f"Error in contracts: {str(e)}"
         logger.error(error_msg)
-        logger.error(f"Exception type: {type(e).__name__}")
-        logger.error(f"Exception traceback: {sys.exc_info()}")
-        return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        logger.error("Exception type: %s", type(e).__name__)
+        logger.error("Exception traceback: %s", sys.exc_info())
+        return {"statusCode": 500, "body": dumps({"error": error_msg})}
 
 @app.route('/contract', methods=['GET'])
 def get_contract():
-    global api
     try:
         code = request.args.get("code")  # 使用官方參數 "code"
         type_ = request.args.get("type", "stock")  # 預設為 stock
@@ -310,121 +434,109 @@ def get_contract():
         if not code:
             error_msg = "Missing required parameter: code"
             logger.error(error_msg)
-            return {"statusCode": 400, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+            return {"statusCode": 400, "body": dumps({"error": error_msg})}
 
-        if api is None:
+        session = state.session
+        if session is None:
             error_msg = "Shioaji API not initialized. Please login first."
             logger.error(error_msg)
-            return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
-
-        logger.info(f"Received contract request: code={code}, type={type_}")
-
-        # 根據 type 選擇合約類型
-        contract = None
-        market = None
-
-        if type_ == "stock":
-            # 嘗試從 TSE 查詢股票合約
-            logger.info(f"Fetching contract for code={code} from TSE")
-            contract = api.Contracts.Stocks.TSE[code]
-            market = "TSE"
-
-            # 如果 TSE 中找不到，嘗試從 OTC 查詢
-            if contract is None:
-                logger.info(f"Contract not found in TSE, trying OTC for code={code}")
-                contract = api.Contracts.Stocks.OTC[code]
-                market = "OTC"
-
-            # 如果 OTC 中找不到，嘗試從 OES（興櫃）查詢
-            if contract is None:
-                logger.info(f"Contract not found in OTC, trying OES for code={code}")
-                try:
-                    contract = api.Contracts.Stocks.OES[code]
-                    market = "OES"
-                except AttributeError:
-                    logger.info("OES market not supported or accessible in this context")
-
-            if contract is None:
-                error_msg = f"Contract not found for code={code} in TSE, OTC, or OES"
-                logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
-
-        elif type_ == "futures":
-            # 查詢期貨合約
-            logger.info(f"Fetching futures contract for code={code}")
-            # 嘗試直接使用 code 查找
-            contract = api.Contracts.Futures[code]
-            market = "Futures"
-
-            # 如果找不到，嘗試列出所有期貨合約進行診斷
-            if contract is None:
-                logger.info(f"Contract not found for code={code}, listing available futures contracts")
-                available_futures = {c.code: c.__dict__ for c in list(api.Contracts.Futures) if hasattr(c, 'code')}
-                logger.info(f"Available futures contracts: {json.dumps(available_futures, default=str)}")
-                error_msg = f"Futures contract not found for code={code}"
-                logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
-
-        elif type_ == "options":
-            # 查詢選擇權合約
-            logger.info(f"Fetching options contract for code={code}")
-            contract = api.Contracts.Options[code]
-            market = "Options"
+            return {"statusCode": 500, "body": dumps({"error": error_msg})}
 
-            if contract is None:
-                error_msg = f"Options contract not found for code={code}"
-                logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        unavailable = contracts_unavailable(session)
+        if unavailable is not None:
+            return unavailable
 
-        elif type_ == "index":
-            # 查詢指數合約
-            logger.info(f"Fetching index contract for code={code} from TSE")
-            contract = api.Contracts.Indexs.TSE[code]
-            market = "Index"
+        refresh_contracts_if_stale(session)
+        api = session.api
 
-            if contract is None:
-                error_msg = f"Index contract not found for code={code} in TSE"
-                logger.error(error_msg)
-                return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        logger.info("Received contract request: code=%s, type=%s", code, type_)
 
-        else:
+        if type_ not in SUPPORTED_TYPES:
             error_msg = f"Unsupported type: {type_}. Supported types are: stock, futures, options, index"
             logger.error(error_msg)
-            return {"statusCode": 400, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+            return {"statusCode": 400, "body": dumps({"error": error_msg})}
+
+        contract, market = session.resolve_contract(code, type_)
+        if contract is None:
+            return contract_not_found(api, code, type_)
 
         # 返回商品檔資訊
         return {
             "statusCode": 200,
-            "body": json.dumps({
+            "body": dumps({
                 "message": "Contract fetched",
                 "contract": {
-                    "exchange": contract.exchange.value if hasattr(contract, 'exchange') else None,
-                    "code": contract.code if hasattr(contract, 'code') else None,
-                    "symbol": contract.symbol if hasattr(contract, 'symbol') else None,
-                    "name": contract.name if hasattr(contract, 'name') else None,
-                    "category": contract.category if hasattr(contract, 'category') else None,
-                    "unit": contract.unit if hasattr(contract, 'unit') else None,
-                    "limit_up": contract.limit_up if hasattr(contract, 'limit_up') else None,
-                    "limit_down": contract.limit_down if hasattr(contract, 'limit_down') else None,
-                    "reference": contract.reference if hasattr(contract, 'reference') else None,
-                    "update_date": contract.update_date if hasattr(contract, 'update_date') else None,
-                    "day_trade": contract.day_trade.value if hasattr(contract, 'day_trade') else None
+                    "exchange": enum_value(getattr(contract, 'exchange', None)),
+                    "code": getattr(contract, 'code', None),
+                    "symbol": getattr(contract, 'symbol', None),
+                    "name": getattr(contract, 'name', None),
+                    "category": getattr(contract, 'category', None),
+                    "unit": getattr(contract, 'unit', None),
+                    "limit_up": getattr(contract, 'limit_up', None),
+                    "limit_down": getattr(contract, 'limit_down', None),
+                    "reference": getattr(contract, 'reference', None),
+                    "update_date": getattr(contract, 'update_date', None),
+                    "day_trade": enum_value(getattr(contract, 'day_trade', None))
                 },
                 "market": market,
                 "type": type_
-            }, default=str, ensure_ascii=False)
+            })
         }
 
     except KeyError as ke:
         error_msg = f"Contract not found for code={code} (type={type_}, KeyError: {str(ke)})"
         logger.error(error_msg)
-        return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        return {"statusCode": 500, "body": dumps({"error": error_msg})}
     except Exception as e:
         error_msg = f"Error in contract: {str(e)} (type={type_})"
         logger.error(error_msg)
-        logger.error(f"Exception type: {type(e).__name__}")
-        logger.error(f"Exception traceback: {sys.exc_info()}")
-        return {"statusCode": 500, "body": json.dumps({"error": error_msg}, ensure_ascii=False)}
+        logger.error("Exception type: %s", type(e).__name__)
+        logger.error("Exception traceback: %s", sys.exc_info())
+        return {"statusCode": 500, "body": dumps({"error": error_msg})}
+
+@app.route('/invalidate', methods=['POST'])
+def invalidate():
+    try:
+        session = state.session
+        if session is None:
+            error_msg = "Shioaji API not initialized. Please login first."
+            logger.error(error_msg)
+            return {"statusCode": 500, "body": dumps({"error": error_msg})}
+
+        logger.info("Received invalidate request")
+        with state.lock:
+            downloading = session.contracts_downloading
+            session.contracts_downloading = True
+        if downloading:
+            error_msg = "Contracts data is still loading. Please retry later."
+            logger.error(error_msg)
+            return {"statusCode": 503, "body": dumps({"error": error_msg})}
+
+        try:
+            loaded = load_contracts(session)
+        finally:
+            with state.lock:
+                session.contracts_downloading = False
+
+        if not loaded:
+            error_msg = "Session was replaced by a new login during refresh"
+            logger.error(error_msg)
+            return {"statusCode": 500, "body": dumps({"error": error_msg})}
+
+        return {
+            "statusCode": 200,
+            "body": dumps({
+                "message": "Contracts refreshed",
+                "expiry": session.contracts_expiry
+            })
+        }
+
+    except Exception as e:
+        error_msg = f"Error in invalidate: {str(e)}"
+        logger.error(error_msg)
+        logger.error("Exception type: %s", type(e).__name__)
+        logger.error("Exception traceback: %s", sys.exc_info())
+        return {"statusCode": 500, "body": dumps({"error": error_msg})}
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080)